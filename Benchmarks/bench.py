@@ -0,0 +1,159 @@
+
+import subprocess
+import tempfile
+import argparse
+import json
+import sys
+import os
+
+# Query benchmark harness
+#
+# Runs each query.py against the newest 1, 30 and 365 full days of
+# an archive made by generate.py, plus today's partial file, reporting wall time, peak RSS and
+# bytes read on top of importing duckdb
+#
+# Run using:
+# python3 generate.py archive --days 365
+# python3 bench.py archive --output baseline.json
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Scripts that only set up tables at module level name the
+# function to call afterwards, along with its arguments
+QUERIES = [
+    ("exec", "InterceptExecEvents/query.py", None),
+    ("fs", "InterceptFSEvents/query.py", None),
+    ("urls", "InterceptURLs/query.py", ("query_past", ["1 day"])),
+]
+
+SOURCES = ["execevents", "fsevents", "urls"]
+
+# Each query runs in its own interpreter so that peak RSS and
+# /proc/self/io counters belong to that query alone
+#
+# rchar counts bytes passed through read() - page cache hits included
+#
+# duckdb is imported before the counters are sampled, otherwise
+# library startup dominates the figures for small archives; the
+# RSS it accounts for is reported separately as import_rss
+RUNNER = """
+import resource
+import runpy
+import json
+import time
+import sys
+
+import duckdb
+
+def rchar():
+    with open("/proc/self/io") as f:
+        for line in f:
+            if line.startswith("rchar:"):
+                return int(line.split()[1])
+
+def maxrss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+script, report, call = sys.argv[1:]
+
+import_rss = maxrss()
+start_rchar = rchar()
+start = time.perf_counter()
+
+scope = runpy.run_path(script, run_name="__main__")
+
+if call != "null":
+    name, args = json.loads(call)
+    scope[name](*args)
+
+wall = time.perf_counter() - start
+rss = maxrss() - import_rss
+
+with open(report, "w") as f:
+    json.dump(dict(wall=wall, rss=rss, import_rss=import_rss, read=rchar() - start_rchar), f)
+"""
+
+def count_files(archive):
+    return min(
+        len([name for name in os.listdir(os.path.join(archive, source)) if name.endswith(".jsonl.zst")])
+        for source in SOURCES
+    )
+
+# Expose today's file and the `days` files before it through symlinks
+#
+# Queries look at yesterday, so a window must reach past today's
+# partial file to match anything
+def make_window(archive, days):
+    window = os.path.join(archive, f"window_{days}")
+
+    for source in SOURCES:
+        src = os.path.join(archive, source)
+        dst = os.path.join(window, source)
+
+        os.makedirs(dst, exist_ok=True)
+
+        for name in os.listdir(dst):
+            os.remove(os.path.join(dst, name))
+
+        names = sorted(name for name in os.listdir(src) if name.endswith(".jsonl.zst"))
+
+        for name in names[-(days + 1):]:
+            os.symlink(os.path.abspath(os.path.join(src, name)), os.path.join(dst, name))
+
+    return window
+
+def run_query(script, call, cwd):
+    with tempfile.NamedTemporaryFile(suffix=".json") as report:
+        proc = subprocess.run(
+            [sys.executable, "-c", RUNNER, os.path.join(ROOT, script), report.name, json.dumps(call)],
+            cwd=cwd,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE
+        )
+
+        if proc.returncode != 0:
+            error = proc.stderr.decode(errors="replace").strip().splitlines()
+            return dict(error=error[-1] if error else f"exit status {proc.returncode}")
+
+        return json.load(report)
+
+def bench(archive, windows):
+    results = []
+    available = count_files(archive) - 1
+
+    if max(windows) > available:
+        sys.exit(f"Archive holds {available} full days, cannot benchmark {max(windows)} days - rerun generate.py with more --days")
+
+    for days in windows:
+        window = make_window(archive, days)
+
+        for name, script, call in QUERIES:
+            result = dict(query=name, days=days, **run_query(script, call, window))
+            results.append(result)
+
+            if "error" in result:
+                print(f"{name:5} {days:4}d  failed: {result['error']}")
+            else:
+                print(
+                    f"{name:5} {days:4}d  "
+                    f"{result['wall']:8.3f} s  "
+                    f"{result['rss'] / 2**20:8.1f} MB RSS "
+                    f"(+{result['import_rss'] / 2**20:.1f} MB import)  "
+                    f"{result['read'] / 2**20:8.1f} MB read"
+                )
+
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark queries against a generated archive")
+    parser.add_argument("archive", help="directory made by generate.py")
+    parser.add_argument("--windows", default="1,30,365", help="comma separated full days of history")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    windows = [int(days) for days in args.windows.split(",")]
+    results = bench(args.archive, windows)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,217 @@
+
+from datetime import datetime, timedelta
+import argparse
+import random
+import json
+import os
+
+from zstandard import ZstdCompressor, FLUSH_BLOCK, FLUSH_FRAME
+
+# Synthetic archive generator for query benchmarks
+#
+# Writes execevents/, fsevents/ and urls/ the way the loggers do:
+# one YYYYMMDD_HHMMSS.jsonl.zst file for each of the given number of
+# full days, followed by today's file cut off at the current time,
+# with events concatenated without separators and flushed whenever
+# zstd has emitted some bytes
+#
+# Run using:
+# python3 generate.py archive --days 365
+#
+# Only .jsonl.zst files are written - the .jsonl.gz twins the
+# loggers keep are never read by the queries
+
+COMMANDS = [
+    ["git", "status"],
+    ["git", "diff"],
+    ["git", "log", "--oneline"],
+    ["git", "commit", "-m", "wip"],
+    ["ls", "--color=auto"],
+    ["ls", "-la"],
+    ["cat", "README.md"],
+    ["grep", "-rn", "TODO", "."],
+    ["vim", "log.py"],
+    ["python3", "query.py"],
+    ["make", "-j8"],
+    ["cc", "-O2", "-c", "main.c", "-o", "main.o"],
+    ["cc", "-O2", "-c", "util.c", "-o", "util.o"],
+    ["ld", "-o", "main", "main.o", "util.o"],
+    ["ssh", "example.org"],
+    ["firefox"],
+    ["man", "bpftrace"],
+    ["less", "/var/log/syslog"],
+    ["duckdb"],
+    ["htop"],
+]
+
+PARENTS = [
+    ("bash", ["/bin/bash"]),
+    ("zsh", ["-zsh"]),
+    ("make", ["make", "-j8"]),
+    ("python3", ["python3", "log.py"]),
+    ("code", ["/usr/share/code/code"]),
+]
+
+FS_TYPES = [
+    "access",
+    "modify",
+    "close_write",
+    "close_nowrite",
+    "open",
+    "create",
+    "delete",
+    "moved_from",
+    "moved_to",
+]
+
+FS_PATHS = [
+    "/home/user/notes.md",
+    "/home/user/.bash_history",
+    "/home/user/.cache/mozilla/firefox/cache2/entries/{}",
+    "/home/user/.config/Code/User/workspaceStorage/{}/state.vscdb",
+    "/home/user/.local/share/recently-used.xbel",
+    "/home/user/projects/SecondSetOfEyes/InterceptURLs/log.py",
+    "/home/user/projects/SecondSetOfEyes/InterceptFSEvents/log.py",
+    "/home/user/projects/SecondSetOfEyes/README.md",
+    "/home/user/projects/app/src/main.c",
+    "/home/user/projects/app/src/util.c",
+    "/home/user/projects/app/build/main.o",
+    "/home/user/Downloads/paper-{}.pdf",
+    "/home/user/Documents/journal/{}.txt",
+]
+
+SITES = [
+    ("https://news.ycombinator.com/item?id={}", "Hacker News"),
+    ("https://github.com/bpftrace/bpftrace/issues/{}", "bpftrace issue - GitHub"),
+    ("https://duckdb.org/docs/data/json/overview#{}", "JSON Overview - DuckDB"),
+    ("https://en.wikipedia.org/wiki/Special:Random/{}", "Wikipedia, the free encyclopedia"),
+    ("https://stackoverflow.com/questions/{}", "python - Stack Overflow"),
+    ("https://www.youtube.com/watch?v={}", "YouTube"),
+    ("https://mail.example.org/#inbox/{}", "Inbox - Mail"),
+]
+
+# Activity is concentrated in waking hours
+HOUR_WEIGHTS = [
+    1, 1, 0, 0, 0, 0, 1, 2, 4, 6, 8, 8,
+    6, 8, 9, 9, 8, 6, 5, 6, 7, 6, 4, 2,
+]
+
+def event_times(rng, day, count, until):
+    hours = rng.choices(range(24), weights=HOUR_WEIGHTS, k=count)
+    times = [
+        day + timedelta(hours=hour, seconds=rng.randrange(3600))
+        for hour in hours
+    ]
+
+    return sorted(time for time in times if time < until)
+
+# Processes come in bursts, e.g. `make -j` compiling a project
+def exec_events(rng, times):
+    burst = 0
+
+    for time in times:
+        if burst == 0:
+            comm, argx = rng.choice(PARENTS)
+            argy = rng.choice(COMMANDS)
+
+            if comm == "make":
+                burst = rng.randrange(20)
+
+        else:
+            burst -= 1
+
+        # bpftrace prints comm and argv of the task that called exec*,
+        # argv is NUL separated with a trailing NUL
+        yield dict(
+            time=time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            comm=comm,
+            argx=argx + [""],
+            argy=argy + [""],
+        )
+
+def fs_events(rng, times):
+    for time in times:
+        path = rng.choice(FS_PATHS).format(rng.randrange(1000))
+
+        yield {
+            "time": time.replace(microsecond=0).isoformat(),
+            "type": rng.choice(FS_TYPES),
+            "path": path,
+        }
+
+def url_events(rng, times):
+    for time in times:
+        url, title = rng.choice(SITES)
+
+        yield dict(
+            time=time.isoformat(),
+            title=title,
+            url=url.format(rng.randrange(10**7)),
+        )
+
+def write_file(fname, events, flush_mode):
+    with open(fname, "wb") as fd:
+        # https://python-zstandard.readthedocs.io/en/latest/compressor.html#zstdcompressionwriter
+        cctx = ZstdCompressor(level=9)
+        writer = cctx.stream_writer(fd)
+        last_tell = writer.tell()
+
+        for event in events:
+            writer.write(json.dumps(event).encode())
+
+            if writer.tell() != last_tell:
+                writer.flush(flush_mode)
+                last_tell = writer.tell()
+
+        writer.close()
+
+def generate(archive, days, exec_per_day, fs_per_day, urls_per_day, seed):
+    rng = random.Random(seed)
+
+    now = datetime.now().astimezone()
+    today = now.replace(
+        hour=0,
+        minute=0,
+        second=0,
+        microsecond=0
+    )
+
+    sources = [
+        ("execevents", exec_events, exec_per_day, FLUSH_BLOCK),
+        ("fsevents", fs_events, fs_per_day, FLUSH_FRAME),
+        ("urls", url_events, urls_per_day, FLUSH_BLOCK),
+    ]
+
+    for name, _, _, _ in sources:
+        os.makedirs(os.path.join(archive, name), exist_ok=True)
+
+    for n in range(days, -1, -1):
+        day = today - timedelta(days=n)
+        timestamp = day.strftime("%Y%m%d_%H%M%S")
+
+        for name, make_events, per_day, flush_mode in sources:
+            fname = os.path.join(archive, name, f"{timestamp}.jsonl.zst")
+            times = event_times(rng, day, per_day, now)
+
+            write_file(fname, make_events(rng, times), flush_mode)
+
+        print("Created", timestamp)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic event archive")
+    parser.add_argument("archive", help="directory to write execevents/, fsevents/ and urls/ into")
+    parser.add_argument("--days", type=int, default=365, help="full days of history before today")
+    parser.add_argument("--exec-per-day", type=int, default=2000)
+    parser.add_argument("--fs-per-day", type=int, default=10000)
+    parser.add_argument("--urls-per-day", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    generate(
+        args.archive,
+        args.days,
+        args.exec_per_day,
+        args.fs_per_day,
+        args.urls_per_day,
+        args.seed
+    )
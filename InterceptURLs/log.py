@@ -1,6 +1,11 @@
 
 from http.server import HTTPServer, BaseHTTPRequestHandler, HTTPStatus
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+import threading
+import time
+import os
+import traceback
 
 from gzip import GzipFile
 from zstandard import ZstdCompressor, FLUSH_BLOCK
@@ -17,54 +22,165 @@ from zstandard import ZstdCompressor, FLUSH_BLOCK
 #
 # Saving payloads amounts to ~200MB of data per hour of general browsing
 #
+# Rotation policy is taken from the environment:
+# ROTATE_EVERY=daily|hourly    start a new file at midnight or every hour
+# ROTATE_BYTES=268435456       also start a new file past this many compressed bytes
+#
 class InterceptURLHandler(BaseHTTPRequestHandler):
     protocol_version = "HTTP/1.1"
     last_gzip_tell = 0
     last_zstd_tell = 0
     urls_zstd = None
     urls_gzip = None
+    timestamp = None
+
+    rotate_every = os.environ.get("ROTATE_EVERY", "daily")
+    rotate_bytes = int(os.environ.get("ROTATE_BYTES", 0))
+
+    if rotate_every not in ("daily", "hourly"):
+        raise ValueError(f"Unknown ROTATE_EVERY [{rotate_every}], expected daily or hourly")
 
     next_file_at = datetime.fromtimestamp(0)
+    next_file = None
+
+    # Opening and closing compressors is slow, so the next file
+    # is opened ahead of time and the previous one is closed
+    # on a worker thread, away from request handling
+    worker = ThreadPoolExecutor(max_workers=1)
+
+    # Writes and rotation happen on different threads
+    lock = threading.Lock()
 
-    # Switch to a new file at midnight
+    # Switch to a new file at midnight or at the top of the hour
     @classmethod
     def reschedule(cls):
-        cls.next_file_at = datetime.now().replace(
-            hour=0,
-            minute=0,
-            second=0,
-            microsecond=0
-        ) + timedelta(days=1)
+        now = datetime.now()
+
+        if cls.rotate_every == "hourly":
+            cls.next_file_at = now.replace(
+                minute=0,
+                second=0,
+                microsecond=0
+            ) + timedelta(hours=1)
+        else:
+            cls.next_file_at = now.replace(
+                hour=0,
+                minute=0,
+                second=0,
+                microsecond=0
+            ) + timedelta(days=1)
+
+    # The next file is written under a placeholder name
+    # and renamed once it is put to use
+    @staticmethod
+    def open_file():
+        fname_zstd = "urls/next.jsonl.zst.part"
+        fname_gzip = "urls/next.jsonl.gz.part"
+
+        urls_zstd_fd = open(fname_zstd, "wb")
+
+        # https://python-zstandard.readthedocs.io/en/latest/compressor.html#zstdcompressionwriter
+        cctx = ZstdCompressor(level=9)
+
+        urls_zstd = cctx.stream_writer(urls_zstd_fd)
+        urls_gzip_fd = open(fname_gzip, "wb")
+
+        # GzipFile writes its header right away - leave out the
+        # placeholder name and the time the file was opened ahead
+        urls_gzip = GzipFile(filename="", mode="wb", fileobj=urls_gzip_fd, mtime=0)
+
+        return fname_zstd, fname_gzip, urls_zstd, urls_gzip
+
+    @staticmethod
+    def close_file(urls_zstd, urls_gzip):
+        # GzipFile leaves a fileobj passed to it open
+        urls_gzip_fd = urls_gzip.fileobj
+
+        urls_zstd.close()
+        urls_gzip.close()
+        urls_gzip_fd.close()
 
     @classmethod
     def begin_next_file(cls):
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+
+        # Two files started within the same second would share
+        # a name; keep writing the current one until the next tick
+        if timestamp == cls.timestamp:
+            return
+
+        if cls.next_file is None:
+            cls.next_file = cls.worker.submit(cls.open_file)
+
+        # Take the pending file out first so that a failed open
+        # or rename is retried with a freshly opened file
+        next_file, cls.next_file = cls.next_file, None
+        part_zstd, part_gzip, urls_zstd, urls_gzip = next_file.result()
+
         fname_zstd = f"urls/{timestamp}.jsonl.zst"
         fname_gzip = f"urls/{timestamp}.jsonl.gz"
 
         print("Creating", fname_zstd)
         print("Creating", fname_gzip)
 
-        urls_zstd_fd = open(fname_zstd, "wb")
+        os.rename(part_zstd, fname_zstd)
+        os.rename(part_gzip, fname_gzip)
 
-        # https://python-zstandard.readthedocs.io/en/latest/compressor.html#zstdcompressionwriter
-        cctx = ZstdCompressor(level=9)
+        if cls.urls_zstd is not None:
+            cls.worker.submit(cls.close_file, cls.urls_zstd, cls.urls_gzip)
 
-        cls.urls_zstd = cctx.stream_writer(urls_zstd_fd)
-        cls.urls_gzip = GzipFile(fname_gzip, "wb")
+        cls.urls_zstd = urls_zstd
+        cls.urls_gzip = urls_gzip
+        cls.timestamp = timestamp
 
         cls.last_zstd_tell = cls.urls_zstd.tell()
         cls.last_gzip_tell = cls.urls_gzip.fileobj.tell()
 
+        cls.next_file = cls.worker.submit(cls.open_file)
+
         cls.reschedule()
 
     @classmethod
     def ensure_schedule(cls):
         if datetime.now() >= cls.next_file_at:
-            cls.urls_zstd.close()
-            cls.urls_gzip.close()
             cls.begin_next_file()
 
+    # Rotation is driven by a timer thread rather than checked
+    # per request - serve_forever() never gets to run its own
+    # periodic actions while Firefox holds the connection open
+    #
+    # The timer ticks at least once a minute: sleep() does not
+    # count time while the machine is suspended, so we recheck
+    # wall clock time as we go
+    #
+    # A failed rotation must not end the thread - we keep
+    # writing the current file and retry a minute later
+    @classmethod
+    def schedule_rotation(cls):
+        while True:
+            try:
+                with cls.lock:
+                    cls.ensure_schedule()
+
+                delay = (cls.next_file_at - datetime.now()).total_seconds()
+            except Exception:
+                traceback.print_exc()
+                print("Rotation failed, retrying in a minute")
+                delay = 60
+
+            time.sleep(min(max(delay, 0.1), 60))
+
+    @classmethod
+    def shutdown(cls):
+        cls.worker.shutdown(wait=True)
+        cls.close_file(cls.urls_zstd, cls.urls_gzip)
+
+        if cls.next_file is not None:
+            part_zstd, part_gzip, urls_zstd, urls_gzip = cls.next_file.result()
+            cls.close_file(urls_zstd, urls_gzip)
+            os.remove(part_zstd)
+            os.remove(part_gzip)
+
     # Keep-Alive is enabled
     # Firefox keeps the connection open forever
     def handle(self):
@@ -88,10 +204,10 @@ class InterceptURLHandler(BaseHTTPRequestHandler):
             self.text_response(f"Unknown path [{self.path}]", status=HTTPStatus.NOT_FOUND)
 
     def handle_intercept(self, payload):
-        self.ensure_schedule()
-        self.urls_zstd.write(payload)
-        self.urls_gzip.write(payload)
-        self.flush()
+        with self.lock:
+            self.urls_zstd.write(payload)
+            self.urls_gzip.write(payload)
+            self.flush()
 
     # We specifically want to keep the file cleanly readable
     # at all points in time - we can sense that zstd stored
@@ -114,6 +230,9 @@ class InterceptURLHandler(BaseHTTPRequestHandler):
             self.last_gzip_tell = self.urls_gzip.fileobj.tell()
             print("Flush gzip")
 
+        if self.rotate_bytes and self.last_zstd_tell >= self.rotate_bytes:
+            self.begin_next_file()
+
     def handle_rx_payload(self, payload, path):
         name = path[len("/intercept_rx_payload/"):]
 
@@ -129,6 +248,8 @@ class InterceptURLHandler(BaseHTTPRequestHandler):
 
 InterceptURLHandler.begin_next_file()
 
+threading.Thread(target=InterceptURLHandler.schedule_rotation, daemon=True).start()
+
 def run(server_address):
     httpd = HTTPServer(server_address, InterceptURLHandler)
 
@@ -138,7 +259,8 @@ def run(server_address):
         pass
     finally:
         print("Shutting down...")
-        InterceptURLHandler.urls_zstd.close()
-        InterceptURLHandler.urls_gzip.close()
+
+        with InterceptURLHandler.lock:
+            InterceptURLHandler.shutdown()
 
 run(("127.0.0.1", 8088))